@@ -1,8 +1,18 @@
 import os
 import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 from dotenv import load_dotenv
+from filelock import FileLock
 
 load_dotenv()
 
@@ -10,6 +20,8 @@ load_dotenv()
 SHOPIFY_STORE_DOMAIN = os.getenv("SHOPIFY_STORE_DOMAIN", "")
 SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
 SHOPIFY_API_VERSION  = os.getenv("SHOPIFY_API_VERSION", "2024-10")
+SHOPIFY_SPLIT_DAYS   = int(os.getenv("SHOPIFY_SPLIT_DAYS", "0"))      # >0 splits wide windows; 0 (default) disables
+SHOPIFY_SPLIT_WORKERS = max(1, int(os.getenv("SHOPIFY_SPLIT_WORKERS", "4")))  # process-wide slice fetches; at least 1
 
 FB_ACCESS_TOKEN      = os.getenv("FB_ACCESS_TOKEN", "")
 FB_AD_ACCOUNT_ID     = os.getenv("FB_AD_ACCOUNT_ID", "")
@@ -17,7 +29,75 @@ FB_AD_ACCOUNT_ID     = os.getenv("FB_AD_ACCOUNT_ID", "")
 CJ_EMAIL             = os.getenv("CJ_EMAIL", "")
 CJ_API_KEY           = os.getenv("CJ_API_KEY", "")
 
+ETL_CACHE_TTL        = int(os.getenv("ETL_CACHE_TTL", "300"))  # seconds; 0 disables
+ETL_CACHE_MAX        = int(os.getenv("ETL_CACHE_MAX", "64"))   # entries
+
+# ---- HTTP session ----
+# One pooled keep-alive session for all fetchers, so pagination follow-ups
+# reuse TCP+TLS connections. Retries absorb rate limits (429) and transient
+# gateway errors with exponential backoff (honours Retry-After).
+def _make_session():
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+_SESSION = _make_session()
+
+# ---- Response cache ----
+# LRU of parsed fetch results keyed on (source, start, end). Repeated dashboard
+# loads (redirects, basis toggles) reuse them instead of re-paginating the APIs.
+# Cached DataFrames are shared; callers must treat them as read-only.
+_result_cache = OrderedDict()  # key -> (stored_monotonic, cached_at, value)
+_result_cache_lock = threading.Lock()
+
+def _cache_get(key):
+    """
+    Returns (cached_at, value) for a fresh entry, else None.
+    Freshness uses the monotonic clock; cached_at is wall-clock UTC for display.
+    """
+    if ETL_CACHE_TTL <= 0:
+        return None
+    with _result_cache_lock:
+        hit = _result_cache.get(key)
+        if hit is None:
+            return None
+        stored, cached_at, value = hit
+        if time.monotonic() - stored > ETL_CACHE_TTL:
+            del _result_cache[key]
+            return None
+        _result_cache.move_to_end(key)
+        return cached_at, value
+
+def _cache_put(key, value):
+    if ETL_CACHE_TTL <= 0:
+        return
+    with _result_cache_lock:
+        _result_cache[key] = (time.monotonic(), datetime.now(timezone.utc), value)
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > ETL_CACHE_MAX:
+            _result_cache.popitem(last=False)
+
+def clear_cache():
+    with _result_cache_lock:
+        _result_cache.clear()
+
 # ---- Shopify ----
+_SHOPIFY_PRICE_FIELDS = ("total_price", "subtotal_price", "total_line_items_price")
+_SHOPIFY_ORDER_FIELDS = ("id", "created_at") + _SHOPIFY_PRICE_FIELDS
+_PAGE_INFO_RE = re.compile(r'page_info=([^&>]+)')
+# Shared by all slice fetches, so SHOPIFY_SPLIT_WORKERS also caps how many
+# slices are in flight against Shopify's rate limit across concurrent loads.
+_split_pool = ThreadPoolExecutor(max_workers=SHOPIFY_SPLIT_WORKERS, thread_name_prefix="shopify-split")
+
 def fetch_shopify_sales_total(start_date, end_date, revenue_basis="total_price"):
     """
     Returns (total_sales_float, orders_df).
@@ -25,54 +105,139 @@ def fetch_shopify_sales_total(start_date, end_date, revenue_basis="total_price")
       - 'total_price'      (includes tax+shipping)
       - 'subtotal_price'   (excludes tax+shipping)
       - 'line_items'       (sum of total_line_items_price)
+    Orders are cached per (start, end), so switching basis does not refetch.
+    """
+    key = ("shopify", str(start_date), str(end_date))
+    hit = _cache_get(key)
+    if hit is not None:
+        df = hit[1]
+    else:
+        df = _fetch_shopify_orders(start_date, end_date)
+        _cache_put(key, df)
+
+    if df.empty:
+        return 0.0, df
+
+    if revenue_basis == "subtotal_price":
+        total = df["subtotal_price"].sum()
+    elif revenue_basis == "line_items":
+        total = df["total_line_items_price"].sum()
+    else:  # total_price
+        total = df["total_price"].sum()
+
+    return float(total), df
+
+def _fetch_shopify_orders(start_date, end_date):
+    """
+    Returns orders_df[id, created_at, total_price, subtotal_price,
+    total_line_items_price] with numeric price columns (empty if no orders).
+    Cursor pagination is serial; with SHOPIFY_SPLIT_DAYS > 0, wide windows
+    are split into slices whose page chains are walked concurrently. Off by
+    default: each slice costs at least one request from Shopify's rate-limit
+    bucket, which only pays off for stores with many pages per window.
     """
     if not SHOPIFY_STORE_DOMAIN or not SHOPIFY_ACCESS_TOKEN:
         raise RuntimeError("Missing Shopify credentials (domain/token).")
 
+    start_ts = pd.to_datetime(start_date).tz_localize("UTC")
+    end_ts = pd.to_datetime(end_date).tz_localize("UTC")
+    windows = _split_window(start_ts, end_ts, SHOPIFY_SPLIT_DAYS)
+
+    if len(windows) == 1:
+        parts = [_fetch_shopify_window(*windows[0])]
+    else:
+        parts = list(_split_pool.map(lambda w: _fetch_shopify_window(*w), windows))
+
+    cols = {k: [v for part in parts for v in part[k]] for k in _SHOPIFY_ORDER_FIELDS}
+    if not cols["id"]:
+        return pd.DataFrame()
+
+    # Slice bounds are inclusive on both ends; drop orders seen twice
+    df = pd.DataFrame(cols).drop_duplicates("id", ignore_index=True)
+    for k in _SHOPIFY_PRICE_FIELDS:
+        df[k] = pd.to_numeric(df[k], errors="coerce")
+    return df
+
+def _next_page_info(link):
+    """
+    page_info cursor of the rel="next" entry in a Link header, else None.
+    From page 2 on Shopify also sends a rel="previous" cursor, so only the
+    next entry may be matched.
+    """
+    for part in link.split(","):
+        if 'rel="next"' in part:
+            m = _PAGE_INFO_RE.search(part)
+            return m.group(1) if m else None
+    return None
+
+def _split_window(start_ts, end_ts, days):
+    """
+    Split [start_ts, end_ts] into consecutive (min, max) slices of at most
+    `days` days. days <= 0 disables splitting.
+    """
+    if days <= 0 or end_ts - start_ts <= pd.Timedelta(days=days):
+        return [(start_ts, end_ts)]
+    edges = list(pd.date_range(start_ts, end_ts, freq=f"{days}D"))
+    if edges[-1] < end_ts:
+        edges.append(end_ts)
+    return list(zip(edges[:-1], edges[1:]))
+
+def _fetch_shopify_window(min_ts, max_ts):
+    """
+    Walk one created_at window's page_info chain.
+    Returns {field: [values...]} for _SHOPIFY_ORDER_FIELDS.
+    """
     url = f"https://{SHOPIFY_STORE_DOMAIN}/admin/api/{SHOPIFY_API_VERSION}/orders.json"
     headers = {"X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN}
+    fields = ",".join(_SHOPIFY_ORDER_FIELDS)
     params = {
         "status": "any",
         "limit": 250,
-        "created_at_min": pd.to_datetime(start_date).tz_localize("UTC").isoformat(),
-        "created_at_max": pd.to_datetime(end_date).tz_localize("UTC").isoformat(),
-        "fields": "id,created_at,total_price,subtotal_price,total_line_items_price"
+        "created_at_min": min_ts.isoformat(),
+        "created_at_max": max_ts.isoformat(),
+        "fields": fields,
     }
 
-    orders = []
-    while True:
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        if not resp.ok:
-            raise RuntimeError(f"Shopify {resp.status_code}: {resp.text[:400]}")
-        batch = resp.json().get("orders", [])
-        if not batch:
-            break
-        orders.extend(batch)
-
-        # pagination via Link header (page_info)
-        link = resp.headers.get("Link", "")
-        if 'rel="next"' in link:
-            import re
-            m = re.search(r'page_info=([^&>]+)', link)
-            if m:
-                params = {"limit": 250, "page_info": m.group(1)}
-            else:
-                break
-        else:
-            break
+    # Column-wise accumulation: only the requested scalar fields are kept,
+    # so there is no need for json_normalize's recursive dict walk.
+    cols = {k: [] for k in _SHOPIFY_ORDER_FIELDS}
+    seen = set()  # cursors already requested; a repeat means the chain loops
+    # One prefetch thread per chain, owned by this call: a shared pool would
+    # make concurrent loads queue behind each other's prefetches.
+    prefetch = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shopify-prefetch")
+    next_page = None
+    try:
+        resp = _SESSION.get(url, headers=headers, params=params, timeout=30)
+        while True:
+            if not resp.ok:
+                raise RuntimeError(f"Shopify {resp.status_code}: {resp.text[:400]}")
 
-    df = pd.json_normalize(orders)
-    if df.empty:
-        return 0.0, df
+            # pagination via Link header (page_info): request page N+1 in the
+            # background before decoding page N, overlapping RTT with parsing.
+            next_page = None
+            page_info = _next_page_info(resp.headers.get("Link", ""))
+            if page_info and page_info not in seen:
+                seen.add(page_info)
+                params = {"limit": 250, "page_info": page_info, "fields": fields}
+                next_page = prefetch.submit(
+                    _SESSION.get, url, headers=headers, params=params, timeout=30
+                )
 
-    if revenue_basis == "subtotal_price":
-        total = pd.to_numeric(df.get("subtotal_price", 0), errors="coerce").sum()
-    elif revenue_basis == "line_items":
-        total = pd.to_numeric(df.get("total_line_items_price", 0), errors="coerce").sum()
-    else:  # total_price
-        total = pd.to_numeric(df.get("total_price", 0), errors="coerce").sum()
+            batch = orjson.loads(resp.content).get("orders", [])
+            if not batch:
+                break
+            for k, vals in cols.items():
+                vals.extend([o.get(k) for o in batch])
 
-    return float(total), df
+            if next_page is None:
+                break
+            resp, next_page = next_page.result(), None
+    finally:
+        # Drop a prefetch nobody will read (empty page, decode or HTTP error)
+        if next_page is not None:
+            next_page.cancel()
+        prefetch.shutdown(wait=False, cancel_futures=True)
+    return cols
 
 
 # ---- Meta (Facebook) ----
@@ -80,6 +245,15 @@ def fetch_fb_ad_spend_total(start_date, end_date):
     """
     Returns (total_spend_float, daily_df[date, fb_spend]).
     """
+    key = ("fb", str(start_date), str(end_date))
+    hit = _cache_get(key)
+    if hit is not None:
+        return hit[1]
+    result = _fetch_fb_ad_spend(start_date, end_date)
+    _cache_put(key, result)
+    return result
+
+def _fetch_fb_ad_spend(start_date, end_date):
     if not FB_ACCESS_TOKEN or not FB_AD_ACCOUNT_ID:
         raise RuntimeError("Missing Facebook credentials (token/ad account).")
 
@@ -94,49 +268,92 @@ def fetch_fb_ad_spend_total(start_date, end_date):
         "level": "account",
         "time_increment": 1,
     }
-    resp = requests.get(url, params=params, timeout=30)
+    resp = _SESSION.get(url, params=params, timeout=30)
     if not resp.ok:
         raise RuntimeError(f"Meta {resp.status_code}: {resp.text[:400]}")
-    data = resp.json().get("data", [])
+    data = orjson.loads(resp.content).get("data", [])
     if not data:
         return 0.0, pd.DataFrame(columns=["date", "fb_spend"])
-    df = pd.DataFrame(data)
-    df["date"] = pd.to_datetime(df["date_start"]).dt.date
-    df["fb_spend"] = pd.to_numeric(df["spend"], errors="coerce").fillna(0.0)
-    return float(df["fb_spend"].sum()), df[["date", "fb_spend"]]
+    # Two known keys per row: build the columns directly rather than letting
+    # pd.DataFrame infer them from the list of dicts.
+    dates = [d.get("date_start") for d in data]
+    spends = [d.get("spend") for d in data]
+    df = pd.DataFrame({
+        "date": pd.to_datetime(dates, format="%Y-%m-%d").date,
+        "fb_spend": pd.to_numeric(pd.Series(spends, dtype="object"), errors="coerce").fillna(0.0).to_numpy(),
+    })
+    return float(df["fb_spend"].sum()), df
 
 
 # ---- CJdropshipping ----
 CJ_BASE = "https://developers.cjdropshipping.com/api2.0/v1"
+_CJ_ORDER_FIELDS = ("createDate", "orderAmount", "productAmount", "postageAmount")
 _cj_token_cache = {"accessToken": None, "expiry": None}
 
+# Shared on-disk copy of the token so every worker process reuses one login
+# instead of each re-authenticating against CJ's rate-limited endpoint.
+CJ_TOKEN_CACHE_PATH  = os.getenv("CJ_TOKEN_CACHE_PATH", os.path.join(".cj_cache", "token.json"))
+_cj_token_lock = FileLock(CJ_TOKEN_CACHE_PATH + ".lock")
+
+def _cj_token_valid(cache, now):
+    return bool(cache["accessToken"]) and cache["expiry"] is not None and now < cache["expiry"]
+
+def _cj_read_token_file():
+    try:
+        with open(CJ_TOKEN_CACHE_PATH, "rb") as f:
+            raw = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    epoch = raw.get("expiry_epoch")
+    expiry = pd.Timestamp(epoch, unit="s", tz="UTC") if epoch is not None else None
+    return {"accessToken": raw.get("token"), "expiry": expiry}
+
+def _cj_write_token_file(token, expiry):
+    epoch = expiry.timestamp() if expiry is not None and not pd.isna(expiry) else None
+    tmp = CJ_TOKEN_CACHE_PATH + ".tmp"
+    # Bearer token: owner-only. chmod as well, in case a stale tmp file exists.
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps({"token": token, "expiry_epoch": epoch}))
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, CJ_TOKEN_CACHE_PATH)  # atomic: readers never see a partial file
+
 def _cj_get_access_token(force=False):
     """
-    Get/refresh CJ access token. Caches until expiry.
+    Get/refresh CJ access token. Caches until expiry, in-process and in a
+    file shared by all workers; the refresh runs under a file lock so a cold
+    start triggers a single auth call.
     Requires CJ_EMAIL + CJ_API_KEY in env.
     """
     if not CJ_EMAIL or not CJ_API_KEY:
         raise RuntimeError("Missing CJ credentials (CJ_EMAIL/CJ_API_KEY).")
 
-    now = pd.Timestamp.utcnow()
-    if (
-        not force
-        and _cj_token_cache["accessToken"]
-        and _cj_token_cache["expiry"] is not None
-        and now < _cj_token_cache["expiry"]
-    ):
+    now = pd.Timestamp.now(tz="UTC")
+    if not force and _cj_token_valid(_cj_token_cache, now):
         return _cj_token_cache["accessToken"]
 
-    url = f"{CJ_BASE}/authentication/getAccessToken"
-    resp = requests.post(url, json={"email": CJ_EMAIL, "apiKey": CJ_API_KEY}, timeout=30)
-    if not resp.ok:
-        raise RuntimeError(f"CJ auth {resp.status_code}: {resp.text[:400]}")
-    data = resp.json().get("data", {})
-    token = data.get("accessToken")
-    expiry_raw = data.get("accessTokenExpiryDate")  # e.g. "2025-08-18T09:16:33+08:00"
-    expiry = pd.to_datetime(expiry_raw, utc=True, errors="coerce") if expiry_raw else (now + pd.Timedelta(days=14))
-    _cj_token_cache.update({"accessToken": token, "expiry": expiry})
-    return token
+    cache_dir = os.path.dirname(CJ_TOKEN_CACHE_PATH)
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        os.chmod(cache_dir, 0o700)  # makedirs leaves an existing dir's mode alone
+    with _cj_token_lock:
+        # Another worker may have refreshed while we waited for the lock
+        shared = _cj_read_token_file()
+        if not force and shared is not None and _cj_token_valid(shared, now):
+            _cj_token_cache.update(shared)
+            return shared["accessToken"]
+
+        url = f"{CJ_BASE}/authentication/getAccessToken"
+        resp = _SESSION.post(url, json={"email": CJ_EMAIL, "apiKey": CJ_API_KEY}, timeout=30)
+        if not resp.ok:
+            raise RuntimeError(f"CJ auth {resp.status_code}: {resp.text[:400]}")
+        data = resp.json().get("data", {})
+        token = data.get("accessToken")
+        expiry_raw = data.get("accessTokenExpiryDate")  # e.g. "2025-08-18T09:16:33+08:00"
+        expiry = pd.to_datetime(expiry_raw, utc=True, errors="coerce") if expiry_raw else (now + pd.Timedelta(days=14))
+        _cj_write_token_file(token, expiry)
+        _cj_token_cache.update({"accessToken": token, "expiry": expiry})
+        return token
 
 def _cj_headers():
     return {"CJ-Access-Token": _cj_get_access_token()}
@@ -149,12 +366,27 @@ def fetch_cj_orders_list(page_size=100, page_num=1, status=None):
     if status:
         params["status"] = status  # CREATED, UNPAID, UNSHIPPED, SHIPPED, DELIVERED, etc.
     url = f"{CJ_BASE}/shopping/order/list"
-    r = requests.get(url, headers=_cj_headers(), params=params, timeout=30)
+    r = _SESSION.get(url, headers=_cj_headers(), params=params, timeout=30)
     if not r.ok:
         raise RuntimeError(f"CJ list {r.status_code}: {r.text[:400]}")
     return r.json().get("data", {})
 
-def fetch_cj_costs_by_day(start_date, end_date):
+def fetch_cj_costs_by_day(start_date, end_date, use_cache=False):
+    """
+    Returns (daily_cost_df[date, cj_cost], total_cost_float, meta).
+    meta: {"source": "api"|"cache", "cached_at": iso str or None}
+    With use_cache=True a fresh cached result for the same window is reused.
+    """
+    key = ("cj", str(start_date), str(end_date))
+    hit = _cache_get(key) if use_cache else None
+    if hit is not None:
+        cached_at, (df, total) = hit
+        return df, total, {"source": "cache", "cached_at": cached_at.isoformat()}
+    df, total = _fetch_cj_costs(start_date, end_date)
+    _cache_put(key, (df, total))
+    return df, total, {"source": "api", "cached_at": None}
+
+def _fetch_cj_costs(start_date, end_date):
     """
     Returns (daily_cost_df[date, cj_cost], total_cost_float).
     Cost per order = prefer orderAmount; else (productAmount + postageAmount).
@@ -165,43 +397,55 @@ def fetch_cj_costs_by_day(start_date, end_date):
 
     page_num = 1
     page_size = 100
-    rows = []
+    cols = {k: [] for k in _CJ_ORDER_FIELDS if k != "createDate"}
+    ts_pages = []
 
+    # Accumulate raw fields across pages; reduce once, vectorized.
     while True:
         data = fetch_cj_orders_list(page_size=page_size, page_num=page_num)
         items = (data or {}).get("list", [])
         if not items:
             break
 
-        for it in items:
-            c_at = it.get("createDate")  # e.g. "2021-03-31 00:46:39"
-            if not c_at:
-                continue
-            c_ts = pd.to_datetime(c_at, utc=True, errors="coerce")
-            if c_ts is pd.NaT:
-                continue
-            if start_ts <= c_ts <= end_ts:
-                order_amt   = pd.to_numeric(it.get("orderAmount"), errors="coerce")
-                product_amt = pd.to_numeric(it.get("productAmount"), errors="coerce")
-                postage_amt = pd.to_numeric(it.get("postageAmount"), errors="coerce")
-
-                if pd.notna(order_amt):
-                    cost = float(order_amt)
-                else:
-                    pa = 0.0 if pd.isna(product_amt) else float(product_amt)
-                    po = 0.0 if pd.isna(postage_amt) else float(postage_amt)
-                    cost = pa + po
-
-                rows.append({"date": c_ts.date(), "cj_cost": cost})
+        for k, vals in cols.items():
+            vals.extend([it.get(k) for it in items])
+        # createDate e.g. "2021-03-31 00:46:39"; missing/unparseable -> NaT, dropped by the window mask
+        page_ts = pd.to_datetime(
+            pd.Series([it.get("createDate") for it in items], dtype="object"),
+            utc=True, format="ISO8601", errors="coerce",
+        )
+        ts_pages.append(page_ts)
+
+        # The list comes newest-first: once a page is in that order and its
+        # oldest order predates the window, later pages cannot contribute.
+        valid_ts = page_ts.dropna()
+        if (
+            not valid_ts.empty
+            and valid_ts.is_monotonic_decreasing
+            and valid_ts.iloc[-1] < start_ts
+        ):
+            break
 
         total = (data or {}).get("total", 0)
         if page_num * page_size >= int(total or 0):
             break
         page_num += 1
 
-    if not rows:
+    if not ts_pages:
+        return pd.DataFrame(columns=["date", "cj_cost"]), 0.0
+    c_ts = pd.concat(ts_pages, ignore_index=True)
+    in_window = c_ts.between(start_ts, end_ts).to_numpy()
+    if not in_window.any():
         df = pd.DataFrame(columns=["date", "cj_cost"])
         return df, 0.0
 
-    df = pd.DataFrame(rows).groupby("date", as_index=False)["cj_cost"].sum()
+    order_amt   = pd.to_numeric(pd.Series(cols["orderAmount"], dtype="object"), errors="coerce")
+    product_amt = pd.to_numeric(pd.Series(cols["productAmount"], dtype="object"), errors="coerce")
+    postage_amt = pd.to_numeric(pd.Series(cols["postageAmount"], dtype="object"), errors="coerce")
+    cost = order_amt.fillna(product_amt.fillna(0.0) + postage_amt.fillna(0.0))
+
+    df = (
+        pd.DataFrame({"date": c_ts[in_window].dt.date, "cj_cost": cost[in_window]})
+        .groupby("date", as_index=False)["cj_cost"].sum()
+    )
     return df, float(df["cj_cost"].sum())
@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import app
+
+
+def _orders(rows):
+    return pd.DataFrame(
+        [{"id": i, "created_at": ts, "total_price": amt} for i, (ts, amt) in enumerate(rows)]
+    )
+
+
+class SalesAggregateTests(unittest.TestCase):
+    def setUp(self):
+        app._agg_cache.clear()
+
+    def test_dst_crossing_window(self):
+        # America/New_York falls back at 2024-11-03 06:00Z.
+        orders = _orders([
+            ("2024-11-03T05:30:00Z", "10"),  # 01:30 EDT, Nov 3
+            ("2024-11-03T06:30:00Z", "20"),  # 01:30 EST, Nov 3
+            ("2024-11-04T03:30:00Z", "5"),   # 22:30 EST, Nov 3
+            ("2024-10-30T03:59:00Z", "7"),   # 23:59 EDT, Oct 29: before range
+            ("2024-10-30T04:00:00Z", "3"),   # 00:00 EDT, Oct 30
+        ])
+        agg = app.build_sales_aggregates(orders, "total_price", "2024-10-30", "2024-11-05")
+
+        self.assertEqual(agg["daily"]["dates"], [
+            "2024-10-30", "2024-10-31", "2024-11-01", "2024-11-02",
+            "2024-11-03", "2024-11-04", "2024-11-05",
+        ])
+        self.assertEqual(agg["daily"]["values"], [3.0, 0.0, 0.0, 0.0, 35.0, 0.0, 0.0])
+        self.assertEqual(agg["dow"]["labels"], ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+        self.assertEqual(agg["dow"]["values"], [0.0, 0.0, 3.0, 0.0, 0.0, 0.0, 35.0])
+        expected_hours = [0.0] * 24
+        expected_hours[0] = 3.0
+        expected_hours[1] = 15.0   # mean of the two 01:30 orders
+        expected_hours[22] = 5.0
+        expected_hours[23] = 7.0   # hour averages cover all orders, not just the range
+        self.assertEqual(agg["hour"]["hours"], list(range(24)))
+        self.assertEqual(agg["hour"]["values"], expected_hours)
+
+    def test_range_shorter_than_a_week(self):
+        orders = _orders([("2025-03-05T15:00:00Z", "10")])  # Wed 10:00 EST
+        agg = app.build_sales_aggregates(orders, "total_price", "2025-03-04", "2025-03-06")
+
+        self.assertEqual(agg["daily"]["dates"], ["2025-03-04", "2025-03-05", "2025-03-06"])
+        self.assertEqual(agg["daily"]["values"], [0.0, 10.0, 0.0])
+        self.assertEqual(agg["dow"]["labels"], ["Tue", "Wed", "Thu"])
+        self.assertEqual(agg["dow"]["values"], [0.0, 10.0, 0.0])
+        self.assertEqual(agg["hour"]["values"][10], 10.0)
+        self.assertEqual(sum(agg["hour"]["values"]), 10.0)
+
+    def test_unparseable_created_at_is_dropped(self):
+        orders = _orders([
+            ("garbage", "100"),
+            (None, "50"),
+            ("2025-03-05T15:00:00Z", "4"),
+        ])
+        agg = app.build_sales_aggregates(orders, "total_price", "2025-03-04", "2025-03-06")
+
+        self.assertEqual(agg["daily"]["values"], [0.0, 4.0, 0.0])
+        self.assertEqual(agg["dow"]["values"], [0.0, 4.0, 0.0])
+        expected_hours = [0.0] * 24
+        expected_hours[10] = 4.0
+        self.assertEqual(agg["hour"]["values"], expected_hours)
+
+
+class AggregateMemoTests(unittest.TestCase):
+    def setUp(self):
+        app._agg_cache.clear()
+        self.orders = pd.DataFrame({
+            "id": [1, 2],
+            "created_at": ["2025-03-05T15:00:00Z", "2025-03-06T15:00:00Z"],
+            "total_price": [10.0, 20.0],
+            "subtotal_price": [9.0, 18.0],
+            "total_line_items_price": [8.0, 16.0],
+        })
+
+    def _spy(self):
+        return mock.patch.object(app, "_aggregate_all_bases", wraps=app._aggregate_all_bases)
+
+    def test_basis_toggle_hits_cache(self):
+        with self._spy() as compute:
+            total = app.build_sales_aggregates(self.orders, "total_price", "2025-03-04", "2025-03-06")
+            sub = app.build_sales_aggregates(self.orders, "subtotal_price", "2025-03-04", "2025-03-06")
+            items = app.build_sales_aggregates(self.orders, "line_items", "2025-03-04", "2025-03-06")
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(total["daily"]["values"], [0.0, 10.0, 20.0])
+        self.assertEqual(sub["daily"]["values"], [0.0, 9.0, 18.0])
+        self.assertEqual(items["daily"]["values"], [0.0, 8.0, 16.0])
+
+    def test_changed_prices_miss_cache(self):
+        refetched = self.orders.copy()
+        refetched["total_price"] = [11.0, 20.0]
+        with self._spy() as compute:
+            app.build_sales_aggregates(self.orders, "total_price", "2025-03-04", "2025-03-06")
+            agg = app.build_sales_aggregates(refetched, "total_price", "2025-03-04", "2025-03-06")
+        self.assertEqual(compute.call_count, 2)
+        self.assertEqual(agg["daily"]["values"], [0.0, 11.0, 20.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
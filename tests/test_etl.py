@@ -0,0 +1,285 @@
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import etl
+
+SHOP = "https://shop.example/admin/api/2024-10/orders.json"
+
+
+class FakeResponse:
+    ok = True
+    status_code = 200
+    text = ""
+
+    def __init__(self, orders, link=""):
+        self.content = json.dumps({"orders": orders}).encode()
+        self.headers = {"Link": link} if link else {}
+
+
+def _order(i):
+    return {"id": i, "created_at": "2025-01-01T10:00:00-05:00", "total_price": "1.00"}
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        etl.clear_cache()
+        self.addCleanup(etl.clear_cache)
+
+    def test_entry_expires_after_ttl(self):
+        with mock.patch.object(etl, "ETL_CACHE_TTL", 10), \
+                mock.patch.object(etl.time, "monotonic", side_effect=[100.0, 105.0, 111.0]):
+            etl._cache_put("k", "v")
+            self.assertEqual(etl._cache_get("k")[1], "v")
+            self.assertIsNone(etl._cache_get("k"))
+
+    def test_evicts_least_recently_used_at_max(self):
+        with mock.patch.multiple(etl, ETL_CACHE_TTL=300, ETL_CACHE_MAX=2):
+            etl._cache_put("a", 1)
+            etl._cache_put("b", 2)
+            etl._cache_get("a")  # "b" is now least recently used
+            etl._cache_put("c", 3)
+            self.assertIsNone(etl._cache_get("b"))
+            self.assertEqual(etl._cache_get("a")[1], 1)
+            self.assertEqual(etl._cache_get("c")[1], 3)
+
+    def test_zero_ttl_disables_cache(self):
+        with mock.patch.object(etl, "ETL_CACHE_TTL", 0):
+            etl._cache_put("k", "v")
+            self.assertIsNone(etl._cache_get("k"))
+        self.assertEqual(len(etl._result_cache), 0)
+
+    def test_cj_meta_reports_cache_hit(self):
+        daily = pd.DataFrame({"date": [], "cj_cost": []})
+        with mock.patch.object(etl, "ETL_CACHE_TTL", 300), \
+                mock.patch.object(etl, "_fetch_cj_costs", return_value=(daily, 0.0)) as fetch:
+            self.assertEqual(etl.fetch_cj_costs_by_day("2025-01-01", "2025-01-02", use_cache=True)[2]["source"], "api")
+            meta = etl.fetch_cj_costs_by_day("2025-01-01", "2025-01-02", use_cache=True)[2]
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(meta["source"], "cache")
+        self.assertIsNotNone(meta["cached_at"])
+
+
+class ShopifyPaginationTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            etl, SHOPIFY_STORE_DOMAIN="shop.example", SHOPIFY_ACCESS_TOKEN="token", SHOPIFY_SPLIT_DAYS=0
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_next_page_info_ignores_previous_cursor(self):
+        link = (
+            f'<{SHOP}?limit=250&page_info=PREV>; rel="previous", '
+            f'<{SHOP}?limit=250&page_info=NEXT>; rel="next"'
+        )
+        self.assertEqual(etl._next_page_info(link), "NEXT")
+        self.assertIsNone(etl._next_page_info(f'<{SHOP}?page_info=PREV>; rel="previous"'))
+        self.assertIsNone(etl._next_page_info(""))
+
+    def test_follows_next_cursor_with_two_cursor_link_header(self):
+        # Page 0 only has "next"; middle pages carry previous + next; the last only "previous".
+        n_pages = 4
+
+        def link_for(page):
+            parts = []
+            if page > 0:
+                parts.append(f'<{SHOP}?limit=250&page_info=p{page - 1}>; rel="previous"')
+            if page < n_pages - 1:
+                parts.append(f'<{SHOP}?limit=250&page_info=p{page + 1}>; rel="next"')
+            return ", ".join(parts)
+
+        requested = []
+
+        def fake_get(url, params=None, **kwargs):
+            page = int(params.get("page_info", "p0")[1:])
+            requested.append(page)
+            return FakeResponse([_order(page)], link_for(page))
+
+        with mock.patch.object(etl._SESSION, "get", side_effect=fake_get):
+            df = etl._fetch_shopify_orders("2025-01-01", "2025-01-02")
+
+        self.assertEqual(requested, [0, 1, 2, 3])
+        self.assertEqual(df["id"].tolist(), [0, 1, 2, 3])
+
+    def test_stops_when_next_cursor_repeats(self):
+        # A misbehaving chain: page 1's "next" points back at page 0's cursor.
+        links = {
+            0: f'<{SHOP}?page_info=p1>; rel="next"',
+            1: f'<{SHOP}?page_info=p0>; rel="previous", <{SHOP}?page_info=p1>; rel="next"',
+        }
+        requested = []
+
+        def fake_get(url, params=None, **kwargs):
+            page = int(params.get("page_info", "p0")[1:])
+            requested.append(page)
+            return FakeResponse([_order(page)], links[page])
+
+        with mock.patch.object(etl._SESSION, "get", side_effect=fake_get):
+            df = etl._fetch_shopify_orders("2025-01-01", "2025-01-02")
+
+        self.assertEqual(requested, [0, 1])
+        self.assertEqual(df["id"].tolist(), [0, 1])
+
+    def _paged_get(self, n_pages, delay=0.0):
+        def fake_get(url, params=None, **kwargs):
+            page = int(params.get("page_info", "p0")[1:])
+            time.sleep(delay)
+            link = f'<{SHOP}?page_info=p{page + 1}>; rel="next"' if page < n_pages - 1 else ""
+            return FakeResponse([_order(page)], link)
+        return fake_get
+
+    def test_concurrent_loads_do_not_share_prefetch_threads(self):
+        delay, n_pages, n_loads = 0.05, 4, 16
+        results = []
+
+        def load():
+            results.append(len(etl._fetch_shopify_orders("2025-01-01", "2025-01-02")))
+
+        with mock.patch.object(etl._SESSION, "get", side_effect=self._paged_get(n_pages, delay)):
+            began = time.monotonic()
+            threads = [threading.Thread(target=load) for _ in range(n_loads)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.monotonic() - began
+
+        self.assertEqual(results, [n_pages] * n_loads)
+        # Each chain is serial (n_pages * delay); loads must not queue behind each other.
+        self.assertLess(elapsed, 2 * n_pages * delay)
+
+    def test_decode_error_propagates(self):
+        def fake_get(url, params=None, **kwargs):
+            resp = FakeResponse([], f'<{SHOP}?page_info=p1>; rel="next"')
+            resp.content = b"not json"
+            return resp
+
+        with mock.patch.object(etl._SESSION, "get", side_effect=fake_get):
+            with self.assertRaises(ValueError):
+                etl._fetch_shopify_orders("2025-01-01", "2025-01-02")
+
+
+class ShopifySplitTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            etl, SHOPIFY_STORE_DOMAIN="shop.example", SHOPIFY_ACCESS_TOKEN="token", SHOPIFY_SPLIT_DAYS=7
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.start = pd.Timestamp("2025-01-01", tz="UTC")
+
+    def test_split_window_exactly_split_days_is_one_slice(self):
+        end = self.start + pd.Timedelta(days=7)
+        self.assertEqual(etl._split_window(self.start, end, 7), [(self.start, end)])
+
+    def test_split_window_one_day_over(self):
+        end = self.start + pd.Timedelta(days=8)
+        mid = self.start + pd.Timedelta(days=7)
+        self.assertEqual(etl._split_window(self.start, end, 7), [(self.start, mid), (mid, end)])
+
+    def test_split_window_start_after_end_is_not_split(self):
+        end = self.start - pd.Timedelta(days=30)
+        self.assertEqual(etl._split_window(self.start, end, 7), [(self.start, end)])
+
+    def test_split_window_disabled(self):
+        end = self.start + pd.Timedelta(days=365)
+        self.assertEqual(etl._split_window(self.start, end, 0), [(self.start, end)])
+
+    def test_orders_on_slice_boundary_are_deduplicated(self):
+        boundary = self.start + pd.Timedelta(days=7)
+        orders = [
+            {"id": 1, "created_at": self.start.isoformat(), "total_price": "1.00"},
+            {"id": 2, "created_at": boundary.isoformat(), "total_price": "2.00"},
+            {"id": 3, "created_at": (boundary + pd.Timedelta(hours=1)).isoformat(), "total_price": "4.00"},
+        ]
+        requested = []
+
+        def fake_get(url, params=None, **kwargs):
+            lo, hi = pd.Timestamp(params["created_at_min"]), pd.Timestamp(params["created_at_max"])
+            requested.append((lo, hi))
+            return FakeResponse([o for o in orders if lo <= pd.Timestamp(o["created_at"]) <= hi])
+
+        with mock.patch.object(etl._SESSION, "get", side_effect=fake_get):
+            df = etl._fetch_shopify_orders("2025-01-01", "2025-01-09")
+
+        self.assertEqual(len(requested), 2)
+        self.assertEqual(sorted(df["id"].tolist()), [1, 2, 3])
+        self.assertEqual(df["total_price"].sum(), 7.0)
+
+
+class CJCostTests(unittest.TestCase):
+    def test_create_date_variants_are_counted(self):
+        items = [
+            {"createDate": "2024-01-15 10:23:45", "orderAmount": 1.0},
+            {"createDate": "2024-01-15T11:00:00", "orderAmount": 2.0},
+            {"createDate": "2024-01-15 12:00:00.5", "orderAmount": 4.0},
+            {"createDate": None, "orderAmount": 8.0},
+        ]
+        page = {"list": items, "total": len(items)}
+        with mock.patch.object(etl, "fetch_cj_orders_list", return_value=page):
+            df, total = etl._fetch_cj_costs("2024-01-15", "2024-01-15")
+
+        self.assertEqual(total, 7.0)
+        self.assertEqual(len(df), 1)
+
+
+class CJTokenCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, ".cj_cache")
+        path = os.path.join(self.cache_dir, "token.json")
+        patcher = mock.patch.multiple(
+            etl,
+            CJ_EMAIL="cj@example.com",
+            CJ_API_KEY="key",
+            CJ_TOKEN_CACHE_PATH=path,
+            _cj_token_lock=etl.FileLock(path + ".lock"),
+            _cj_token_cache={"accessToken": None, "expiry": None},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = path
+
+    def _write_shared(self, token, expiry_epoch):
+        os.makedirs(self.cache_dir, mode=0o755, exist_ok=True)
+        os.chmod(self.cache_dir, 0o755)
+        with open(self.path, "w") as f:
+            json.dump({"token": token, "expiry_epoch": expiry_epoch}, f)
+
+    def _auth_response(self, token):
+        resp = mock.Mock(ok=True)
+        resp.json.return_value = {
+            "data": {"accessToken": token, "accessTokenExpiryDate": "2099-01-01T00:00:00+00:00"}
+        }
+        return resp
+
+    def test_valid_shared_token_skips_auth(self):
+        self._write_shared("shared", pd.Timestamp("2099-01-01", tz="UTC").timestamp())
+        with mock.patch.object(etl._SESSION, "post") as post:
+            self.assertEqual(etl._cj_get_access_token(), "shared")
+        post.assert_not_called()
+        self.assertEqual(etl._cj_token_cache["accessToken"], "shared")
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_dir).st_mode), 0o700)
+
+    def test_missing_expiry_forces_refresh(self):
+        self._write_shared("stale", None)  # NaT expiry is stored as null
+        etl._cj_token_cache.update({"accessToken": "stale", "expiry": pd.NaT})
+        with mock.patch.object(etl._SESSION, "post", return_value=self._auth_response("fresh")) as post:
+            self.assertEqual(etl._cj_get_access_token(), "fresh")
+        post.assert_called_once()
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["token"], "fresh")
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+
+if __name__ == "__main__":
+    unittest.main()